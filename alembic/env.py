@@ -19,6 +19,7 @@ if config.config_file_name is not None:
 # from myapp import mymodel
 # target_metadata = mymodel.Base.metadata
 from src.app.models.models_db import Base
+import src.app.models.metric  # noqa: F401  registers the metric tables on Base
 target_metadata = Base.metadata
 
 # other values from the config, defined by the needs of env.py,
@@ -0,0 +1,131 @@
+"""LLM usage daily rollups
+
+Revision ID: 529c94cd9745
+Revises: 1636e918583a
+Create Date: 2026-10-15 23:05:12.418390
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '529c94cd9745'
+down_revision: Union[str, Sequence[str], None] = '1636e918583a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    tables = sa.inspect(op.get_bind()).get_table_names()
+
+    # The metric tables were only ever created from the models, so databases
+    # built from this history may not have them yet.
+    if 'metric_snapshots' not in tables:
+        op.create_table('metric_snapshots',
+        sa.Column('id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('tenant_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('metric_name', sa.String(length=255), nullable=False),
+        sa.Column('metric_value', sa.Float(), nullable=False),
+        sa.Column('labels', sa.JSON(), nullable=True),
+        sa.Column('timestamp', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index('idx_tenant_metric_time', 'metric_snapshots', ['tenant_id', 'metric_name', 'timestamp'], unique=False)
+        op.create_index(op.f('ix_metric_snapshots_tenant_id'), 'metric_snapshots', ['tenant_id'], unique=False)
+
+    if 'performance_logs' not in tables:
+        op.create_table('performance_logs',
+        sa.Column('id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('endpoint', sa.String(length=255), nullable=False),
+        sa.Column('method', sa.String(length=10), nullable=True),
+        sa.Column('duration_ms', sa.Float(), nullable=False),
+        sa.Column('status_code', sa.Integer(), nullable=True),
+        sa.Column('tenant_id', postgresql.UUID(as_uuid=True), nullable=True),
+        sa.Column('user_id', postgresql.UUID(as_uuid=True), nullable=True),
+        sa.Column('metadata', sa.JSON(), nullable=True),
+        sa.Column('timestamp', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index(op.f('ix_performance_logs_tenant_id'), 'performance_logs', ['tenant_id'], unique=False)
+        op.create_index(op.f('ix_performance_logs_timestamp'), 'performance_logs', ['timestamp'], unique=False)
+
+    rebuild_covering_index = 'llm_usage_logs' in tables
+    if not rebuild_covering_index:
+        op.create_table('llm_usage_logs',
+        sa.Column('id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('tenant_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('user_id', postgresql.UUID(as_uuid=True), nullable=True),
+        sa.Column('class_id', sa.String(length=255), nullable=True),
+        sa.Column('provider', sa.String(length=50), nullable=False),
+        sa.Column('model', sa.String(length=100), nullable=False),
+        sa.Column('purpose', sa.String(length=100), nullable=True),
+        sa.Column('input_tokens', sa.Integer(), nullable=False),
+        sa.Column('output_tokens', sa.Integer(), nullable=False),
+        sa.Column('total_tokens', sa.Integer(), nullable=False),
+        sa.Column('cost_usd', sa.Float(), nullable=False),
+        sa.Column('request_id', sa.String(length=255), nullable=True),
+        sa.Column('trace_id', sa.String(length=255), nullable=True),
+        sa.Column('metadata', sa.JSON(), nullable=True),
+        sa.Column('timestamp', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index('idx_provider_model', 'llm_usage_logs', ['provider', 'model'], unique=False)
+        op.create_index('idx_tenant_time', 'llm_usage_logs', ['tenant_id', 'timestamp'], unique=False, postgresql_include=['cost_usd', 'total_tokens', 'provider', 'model'])
+        op.create_index(op.f('ix_llm_usage_logs_tenant_id'), 'llm_usage_logs', ['tenant_id'], unique=False)
+        op.create_index(op.f('ix_llm_usage_logs_timestamp'), 'llm_usage_logs', ['timestamp'], unique=False)
+    else:
+        columns = {c['name'] for c in sa.inspect(op.get_bind()).get_columns('llm_usage_logs')}
+        if 'class_id' not in columns:
+            op.add_column('llm_usage_logs', sa.Column('class_id', sa.String(length=255), nullable=True))
+
+    op.create_table('llm_usage_daily_rollups',
+    sa.Column('tenant_id', postgresql.UUID(as_uuid=True), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('class_id', sa.String(length=255), nullable=False),
+    sa.Column('provider', sa.String(length=50), nullable=False),
+    sa.Column('model', sa.String(length=100), nullable=False),
+    sa.Column('cost_usd', sa.Float(), nullable=False),
+    sa.Column('total_tokens', sa.Integer(), nullable=False),
+    sa.Column('total_calls', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('tenant_id', 'day', 'class_id', 'provider', 'model')
+    )
+
+    # Run this before deploying the code that upserts the rollup; rows the new
+    # flusher writes in the meantime would otherwise be counted twice.
+    op.execute(
+        """
+        INSERT INTO llm_usage_daily_rollups
+            (tenant_id, day, class_id, provider, model,
+             cost_usd, total_tokens, total_calls)
+        SELECT tenant_id, CAST("timestamp" AS date), COALESCE(class_id, 'unknown'),
+               provider, model, SUM(cost_usd), SUM(total_tokens), COUNT(*)
+        FROM llm_usage_logs
+        GROUP BY 1, 2, 3, 4, 5
+        """
+    )
+
+    if rebuild_covering_index:
+        # CONCURRENTLY cannot run inside a transaction, and building it under
+        # a temporary name keeps idx_tenant_time usable until the swap.
+        with op.get_context().autocommit_block():
+            op.create_index('idx_tenant_time_covering', 'llm_usage_logs', ['tenant_id', 'timestamp'], unique=False, postgresql_include=['cost_usd', 'total_tokens', 'provider', 'model'], postgresql_concurrently=True)
+            op.drop_index('idx_tenant_time', table_name='llm_usage_logs', postgresql_concurrently=True, if_exists=True)
+            op.execute('ALTER INDEX idx_tenant_time_covering RENAME TO idx_tenant_time')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # The metric tables themselves are left in place: they may predate this
+    # revision, and the code before it still writes to them.
+    with op.get_context().autocommit_block():
+        op.create_index('idx_tenant_time_plain', 'llm_usage_logs', ['tenant_id', 'timestamp'], unique=False, postgresql_concurrently=True)
+        op.drop_index('idx_tenant_time', table_name='llm_usage_logs', postgresql_concurrently=True, if_exists=True)
+        op.execute('ALTER INDEX idx_tenant_time_plain RENAME TO idx_tenant_time')
+
+    op.drop_table('llm_usage_daily_rollups')
+    op.drop_column('llm_usage_logs', 'class_id')
@@ -2,7 +2,7 @@ import uuid
 from datetime import datetime
 
 from settings import Base
-from sqlalchemy import JSON, Column, DateTime, Float, Index, Integer, String
+from sqlalchemy import JSON, Column, Date, DateTime, Float, Index, Integer, String
 from sqlalchemy.dialects.postgresql import UUID
 
 
@@ -27,6 +27,7 @@ class LLMUsageLog(Base):
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     tenant_id = Column(UUID(as_uuid=True), nullable=False, index=True)
     user_id = Column(UUID(as_uuid=True))
+    class_id = Column(String(255))
 
     provider = Column(String(50), nullable=False)
     model = Column(String(100), nullable=False)
@@ -41,15 +42,38 @@ class LLMUsageLog(Base):
     request_id = Column(String(255))
     trace_id = Column(String(255))
 
-    metadata = Column(JSON)
+    # "metadata" is reserved on declarative classes; keep the DB column name.
+    metadata_ = Column("metadata", JSON, key="metadata_")
     timestamp = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
 
     __table_args__ = (
-        Index("idx_tenant_time", "tenant_id", "timestamp"),
+        # Covering index so the per-tenant cost aggregates are index-only scans.
+        Index(
+            "idx_tenant_time",
+            "tenant_id",
+            "timestamp",
+            postgresql_include=["cost_usd", "total_tokens", "provider", "model"],
+        ),
         Index("idx_provider_model", "provider", "model"),
     )
 
 
+class LLMUsageDailyRollup(Base):
+    """Per-day LLM usage totals, kept in step with llm_usage_logs by MetricsService."""
+
+    __tablename__ = "llm_usage_daily_rollups"
+
+    tenant_id = Column(UUID(as_uuid=True), primary_key=True)
+    day = Column(Date, primary_key=True)
+    class_id = Column(String(255), primary_key=True)
+    provider = Column(String(50), primary_key=True)
+    model = Column(String(100), primary_key=True)
+
+    cost_usd = Column(Float, nullable=False, default=0.0)
+    total_tokens = Column(Integer, nullable=False, default=0)
+    total_calls = Column(Integer, nullable=False, default=0)
+
+
 class PerformanceLog(Base):
     __tablename__ = "performance_logs"
 
@@ -63,5 +87,5 @@ class PerformanceLog(Base):
     tenant_id = Column(UUID(as_uuid=True), index=True)
     user_id = Column(UUID(as_uuid=True))
 
-    metadata = Column(JSON)
+    metadata_ = Column("metadata", JSON, key="metadata_")
     timestamp = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
@@ -1,17 +1,9 @@
 import os
-import pandas as pd
-from typing import Optional
 
 # Assuming vector_store is created and available.
-from .vector_store import create_vector_store
-
-# Initialize the vector store once when the module is loaded.
-print("Initializing vector store for RAG node...")
-if os.environ.get("GOOGLE_API_KEY"):
-    VECTOR_STORE = create_vector_store()
-    print("Vector store initialized.")
-else:
-    VECTOR_STORE = None
+from .vector_store import get_vector_store
+
+if not os.environ.get("GOOGLE_API_KEY"):
     print("WARNING: GOOGLE_API_KEY not set. RAG node will not work.")
 
 
@@ -20,7 +12,9 @@ def retrieve_context_node(state: dict) -> dict:
     Performs a filtered similarity search in the vector store.
     """
     print("---NODE: RETRIEVING CONTEXT---")
-    if VECTOR_STORE is None:
+    # The vector store is built lazily on first use and shared with other nodes.
+    vector_store = get_vector_store()
+    if vector_store is None:
         print("ERROR: Vector store not initialized.")
         return {"context": "Помилка: Векторна база даних не ініціалізована."}
 
@@ -39,7 +33,7 @@ def retrieve_context_node(state: dict) -> dict:
             }
 
     # Perform the similarity search with the filter
-    results = VECTOR_STORE.similarity_search(user_query, **search_kwargs)
+    results = vector_store.similarity_search(user_query, **search_kwargs)
     
     # Format the results
     context_parts = []
@@ -5,17 +5,15 @@ from typing import TypedDict, List, Optional
 from langchain_core.messages import HumanMessage
 from langchain_google_genai import ChatGoogleGenerativeAI
 
-from .vector_store import create_vector_store
+from .vector_store import get_vector_store
 
 # --- Pre-load dependencies ---
 if os.environ.get("GOOGLE_API_KEY"):
     GENERATOR_LLM = ChatGoogleGenerativeAI(model="gemini-1.5-flash", temperature=0.7)
     # Enable JSON output mode for structured generation
     GENERATOR_LLM = GENERATOR_LLM.bind(response_mime_type="application/json")
-    VECTOR_STORE = create_vector_store()
 else:
     GENERATOR_LLM = None
-    VECTOR_STORE = None
     print("WARNING: GOOGLE_API_KEY not set. Generation node will not work.")
 
 # --- Data Structures for Structured Output ---
@@ -78,7 +76,9 @@ def tutor_generation_node(state: dict) -> dict:
     Generates a personalized lesson (summary + exercises) using LC-RAG.
     """
     print("---NODE: TUTOR GENERATION (LC-RAG)---")
-    if GENERATOR_LLM is None or VECTOR_STORE is None:
+    # The vector store is built lazily on first use and shared with the RAG node.
+    vector_store = get_vector_store()
+    if GENERATOR_LLM is None or vector_store is None:
         return {"generated_material": None, "messages": [HumanMessage(content="Помилка: Генератор не ініціалізовано.")]}
 
     # --- 1. Scoped Retrieval ---
@@ -93,7 +93,7 @@ def tutor_generation_node(state: dict) -> dict:
             print(f"Retrieving context within page range: {start_page}-{end_page}")
             search_kwargs["filter"] = {"book_page_number": {"$gte": start_page, "$lte": end_page}}
 
-    results = VECTOR_STORE.similarity_search(user_query, **search_kwargs)
+    results = vector_store.similarity_search(user_query, **search_kwargs)
     context_str = "\n\n".join([f"Джерело: стор. {doc.metadata.get('book_page_number', 'N/A')}\nТекст: {doc.page_content}" for doc in results])
 
     # --- 2. Prompt Engineering (Adaptive Instructions) ---
@@ -1,4 +1,6 @@
 import os
+from functools import cache
+
 from langchain_core.documents import Document
 from langchain_core.vectorstores import InMemoryVectorStore
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
@@ -41,6 +43,18 @@ def create_vector_store():
 
     return vector_store
 
+@cache
+def get_vector_store():
+    """
+    Returns the shared vector store, building it on first use.
+
+    Returns:
+        The process-wide InMemoryVectorStore, or None if GOOGLE_API_KEY is not set.
+    """
+    if not os.environ.get("GOOGLE_API_KEY"):
+        return None
+    return create_vector_store()
+
 if __name__ == '__main__':
     # Example usage:
     # Make sure to set the GOOGLE_API_KEY environment variable
@@ -19,6 +19,8 @@ class Settings(BaseSettings):
     DB_POOL_SIZE: int = 20
     DB_MAX_OVERFLOW: int = 40
     DB_ECHO: bool = False
+    # Prepared statements are per connection: pgbouncer must use session pooling.
+    DB_STATEMENT_CACHE_SIZE: int = 1024
 
     REDIS_URL: str = "redis://localhost:6379/0"
     REDIS_CACHE_TTL: int = 3600
@@ -44,4 +46,7 @@ class Settings(BaseSettings):
 
 @lru_cache()
 def get_settings() -> Settings:
-    return Settings()
\ No newline at end of file
+    return Settings()
+
+
+settings = get_settings()
@@ -25,6 +25,10 @@ class TelemetryConfig(BaseModel):
     otel_enabled: bool = True
     otel_endpoint: Optional[str] = None
     otel_service_name: str = "vyvchai"
+    otel_max_queue_size: int = 16384
+    otel_max_export_batch_size: int = 2048
+    otel_schedule_delay_millis: int = 2000
+    otel_gzip_compression: bool = True
 
     trace_sample_rate: float = 1.0
 
@@ -9,6 +9,12 @@ engine = create_async_engine(
     pool_size=settings.DB_POOL_SIZE,
     max_overflow=settings.DB_MAX_OVERFLOW,
     pool_pre_ping=True,
+    connect_args={
+        # Cache asyncpg prepared statements so the parameterized metrics
+        # aggregates skip parse/plan on repeat executions.
+        "statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+        "prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+    },
 )
 
 AsyncSessionLocal = async_sessionmaker(
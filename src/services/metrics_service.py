@@ -1,18 +1,96 @@
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional
+import asyncio
+import json
+import time
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
 
 import structlog
-from app.models.metric import LLMUsageLog
-from sqlalchemy import func, select
+from app.models.metric import LLMUsageDailyRollup, LLMUsageLog
+from core.config import settings
+from db.session import AsyncSessionLocal
+from sqlalchemy import and_, func, insert, or_, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
 logger = structlog.get_logger()
 
+LLM_USAGE_BATCH_SIZE = 1000
+LLM_USAGE_COPY_THRESHOLD = 500
+LLM_USAGE_FLUSH_INTERVAL_SECONDS = 0.2
+LLM_USAGE_QUEUE_MAXSIZE = 10_000
+
+BREAKDOWN_CACHE_TTL_SECONDS = 3600
+BREAKDOWN_CACHE_MAXSIZE = 1024
+# Margin after midnight before a day's rollup rows are treated as final, so
+# the last flush of the day (at most a batch interval late) has landed.
+BREAKDOWN_CACHE_SETTLE_SECONDS = 60
+
+_breakdown_cache: Dict[Tuple, Tuple[float, Tuple[Tuple, ...]]] = {}
+
+# Queued by stop() behind any pending rows; the flusher writes what it has
+# and exits when it reaches it.
+_STOP_FLUSHER = object()
+
+_LLM_USAGE_COPY_COLUMNS = (
+    "id",
+    "tenant_id",
+    "user_id",
+    "class_id",
+    "provider",
+    "model",
+    "purpose",
+    "input_tokens",
+    "output_tokens",
+    "total_tokens",
+    "cost_usd",
+    "request_id",
+    "trace_id",
+    "metadata",
+    "timestamp",
+)
+
+
+def _utcnow() -> datetime:
+    # Timestamp columns are naive UTC, so drop tzinfo after reading the clock.
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _as_naive_utc(value: datetime) -> datetime:
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
 
 class MetricsService:
-    @staticmethod
+    _llm_usage_queue: Optional[asyncio.Queue] = None
+    _flusher_task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def start(cls):
+        """Start the background LLM usage flusher on the running event loop."""
+        if cls._flusher_task is not None and not cls._flusher_task.done():
+            return
+
+        if cls._llm_usage_queue is None:
+            cls._llm_usage_queue = asyncio.Queue(maxsize=LLM_USAGE_QUEUE_MAXSIZE)
+
+        cls._flusher_task = asyncio.create_task(cls._flush_llm_usage_loop())
+
+    @classmethod
+    async def stop(cls):
+        """Stop the flusher, writing out anything still queued."""
+        if cls._flusher_task is None:
+            return
+
+        if not cls._flusher_task.done():
+            await cls._llm_usage_queue.put(_STOP_FLUSHER)
+            await cls._flusher_task
+        cls._flusher_task = None
+
+    @classmethod
     async def log_llm_usage(
-        db: AsyncSession,
+        cls,
         tenant_id: str,
         user_id: Optional[str],
         provider: str,
@@ -21,58 +99,252 @@ class MetricsService:
         input_tokens: int,
         output_tokens: int,
         cost_usd: float,
-        request_id: str,
-        trace_id: str,
+        request_id: Optional[str],
+        trace_id: Optional[str],
         metadata: Optional[Dict] = None,
+        *,
+        class_id: Optional[str] = None,
     ):
-        log_entry = LLMUsageLog(
-            tenant_id=tenant_id,
-            user_id=user_id,
-            provider=provider,
-            model=model,
-            purpose=purpose,
-            input_tokens=input_tokens,
-            output_tokens=output_tokens,
-            total_tokens=input_tokens + output_tokens,
-            cost_usd=cost_usd,
-            request_id=request_id,
-            trace_id=trace_id,
-            metadata=metadata or {},
+        if cls._flusher_task is None or cls._flusher_task.done():
+            cls.start()
+
+        # Blocks only when the queue is full, which backpressures callers
+        # instead of growing memory without bound.
+        await cls._llm_usage_queue.put(
+            {
+                "tenant_id": tenant_id,
+                "user_id": user_id,
+                "class_id": class_id,
+                "provider": provider,
+                "model": model,
+                "purpose": purpose,
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+                "total_tokens": input_tokens + output_tokens,
+                "cost_usd": cost_usd,
+                "request_id": request_id,
+                "trace_id": trace_id,
+                "metadata_": metadata or {},
+                "timestamp": _utcnow(),
+            }
+        )
+
+    @classmethod
+    async def _flush_llm_usage_loop(cls):
+        queue = cls._llm_usage_queue
+
+        while True:
+            item = await queue.get()
+            if item is _STOP_FLUSHER:
+                return
+
+            batch: List[Dict] = [item]
+            stopping = False
+            deadline = time.monotonic() + LLM_USAGE_FLUSH_INTERVAL_SECONDS
+
+            while len(batch) < LLM_USAGE_BATCH_SIZE:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP_FLUSHER:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await cls._write_llm_usage(batch)
+            if stopping:
+                return
+
+    @staticmethod
+    async def _write_llm_usage(batch: List[Dict]):
+        try:
+            async with AsyncSessionLocal() as db:
+                # The rollup upsert runs first so the session has already begun
+                # its transaction; COPY on the raw driver connection would
+                # otherwise autocommit on its own.
+                await MetricsService._update_daily_rollup(db, batch)
+
+                if settings.DEBUG:
+                    db.add_all([LLMUsageLog(**row) for row in batch])
+                elif len(batch) >= LLM_USAGE_COPY_THRESHOLD:
+                    await MetricsService._copy_llm_usage(db, batch)
+                else:
+                    # Write-only audit log: skip mapped instances and the unit of
+                    # work, and let the driver run the batch as an executemany.
+                    await db.execute(insert(LLMUsageLog.__table__), batch)
+                await db.commit()
+        except Exception as e:
+            logger.error("llm_usage_flush_failed", error=str(e), rows=len(batch))
+
+    @staticmethod
+    async def _copy_llm_usage(db: AsyncSession, batch: List[Dict]):
+        # COPY skips SQL parsing and column defaults, so the Python-side
+        # default for id is filled in here.
+        records = [
+            (
+                uuid.uuid4(),
+                row["tenant_id"],
+                row["user_id"],
+                row["class_id"],
+                row["provider"],
+                row["model"],
+                row["purpose"],
+                row["input_tokens"],
+                row["output_tokens"],
+                row["total_tokens"],
+                row["cost_usd"],
+                row["request_id"],
+                row["trace_id"],
+                json.dumps(row["metadata_"]),
+                row["timestamp"],
+            )
+            for row in batch
+        ]
+
+        conn = await db.connection()
+        raw = await conn.get_raw_connection()
+        await raw.driver_connection.copy_records_to_table(
+            LLMUsageLog.__tablename__,
+            records=records,
+            columns=_LLM_USAGE_COPY_COLUMNS,
+        )
+
+    @staticmethod
+    async def _update_daily_rollup(db: AsyncSession, batch: List[Dict]):
+        totals: Dict[Tuple, List] = {}
+        for row in batch:
+            key = (
+                row["tenant_id"],
+                row["timestamp"].date(),
+                # Primary key columns cannot be NULL, so unattributed calls are
+                # grouped as "unknown", matching the Prometheus label default.
+                row["class_id"] or "unknown",
+                row["provider"],
+                row["model"],
+            )
+            entry = totals.get(key)
+            if entry is None:
+                entry = totals[key] = [0.0, 0, 0]
+            entry[0] += row["cost_usd"]
+            entry[1] += row["total_tokens"]
+            entry[2] += 1
+
+        table = LLMUsageDailyRollup.__table__
+        stmt = pg_insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["tenant_id", "day", "class_id", "provider", "model"],
+            set_={
+                "cost_usd": table.c.cost_usd + stmt.excluded.cost_usd,
+                "total_tokens": table.c.total_tokens + stmt.excluded.total_tokens,
+                "total_calls": table.c.total_calls + stmt.excluded.total_calls,
+            },
+        )
+        await db.execute(
+            stmt,
+            [
+                {
+                    "tenant_id": tenant_id,
+                    "day": day,
+                    "class_id": class_id,
+                    "provider": provider,
+                    "model": model,
+                    "cost_usd": cost_usd,
+                    "total_tokens": total_tokens,
+                    "total_calls": total_calls,
+                }
+                for (tenant_id, day, class_id, provider, model), (
+                    cost_usd,
+                    total_tokens,
+                    total_calls,
+                ) in totals.items()
+            ],
         )
 
-        db.add(log_entry)
-        await db.flush()
+    @staticmethod
+    def _split_window(start_date: datetime, end_date: datetime):
+        """Split [start_date, end_date] into whole days served by the rollup and
+        the live-table condition covering the partial days around them."""
+        first = datetime.combine(start_date.date(), datetime.min.time())
+        if first < start_date:
+            first += timedelta(days=1)
+        last = datetime.combine(end_date.date(), datetime.min.time())
+
+        if first >= last:
+            live = and_(
+                LLMUsageLog.timestamp >= start_date, LLMUsageLog.timestamp <= end_date
+            )
+            return None, live
+
+        live = or_(
+            and_(LLMUsageLog.timestamp >= start_date, LLMUsageLog.timestamp < first),
+            and_(LLMUsageLog.timestamp >= last, LLMUsageLog.timestamp <= end_date),
+        )
+        days: Tuple[date, date] = (first.date(), last.date())
+        return days, live
 
     @staticmethod
     async def get_tenant_llm_cost(
         db: AsyncSession, tenant_id: str, start_date: datetime, end_date: datetime
     ) -> Dict:
+        days, live = MetricsService._split_window(
+            _as_naive_utc(start_date), _as_naive_utc(end_date)
+        )
+
         result = await db.execute(
             select(
                 func.sum(LLMUsageLog.cost_usd).label("total_cost"),
                 func.sum(LLMUsageLog.total_tokens).label("total_tokens"),
                 func.count(LLMUsageLog.id).label("total_calls"),
-            ).where(
-                LLMUsageLog.tenant_id == tenant_id,
-                LLMUsageLog.timestamp >= start_date,
-                LLMUsageLog.timestamp <= end_date,
-            )
+            ).where(LLMUsageLog.tenant_id == tenant_id, live)
         )
 
         row = result.one()
+        total_cost = float(row.total_cost or 0)
+        total_tokens = int(row.total_tokens or 0)
+        total_calls = int(row.total_calls or 0)
+
+        if days is not None:
+            result = await db.execute(
+                select(
+                    func.sum(LLMUsageDailyRollup.cost_usd).label("total_cost"),
+                    func.sum(LLMUsageDailyRollup.total_tokens).label("total_tokens"),
+                    func.sum(LLMUsageDailyRollup.total_calls).label("total_calls"),
+                ).where(
+                    LLMUsageDailyRollup.tenant_id == tenant_id,
+                    LLMUsageDailyRollup.day >= days[0],
+                    LLMUsageDailyRollup.day < days[1],
+                )
+            )
+
+            row = result.one()
+            total_cost += float(row.total_cost or 0)
+            total_tokens += int(row.total_tokens or 0)
+            total_calls += int(row.total_calls or 0)
+
         return {
-            "total_cost_usd": float(row.total_cost or 0),
-            "total_tokens": int(row.total_tokens or 0),
-            "total_calls": int(row.total_calls or 0),
+            "total_cost_usd": total_cost,
+            "total_tokens": total_tokens,
+            "total_calls": total_calls,
         }
 
     @staticmethod
     async def get_cost_breakdown_by_model(
-        db: AsyncSession, tenant_id: str, days: int = 30
+        db: AsyncSession,
+        tenant_id: str,
+        start_date: datetime,
+        end_date: Optional[datetime] = None,
     ) -> List[Dict]:
-        start_date = datetime.utcnow() - timedelta(days=days)
+        now = _utcnow()
+        start_date = _as_naive_utc(start_date)
+        end_date = now if end_date is None else _as_naive_utc(end_date)
 
-        result = await db.execute(
+        rollup_days, live = MetricsService._split_window(start_date, end_date)
+
+        live_query = (
             select(
                 LLMUsageLog.provider,
                 LLMUsageLog.model,
@@ -80,20 +352,81 @@ class MetricsService:
                 func.sum(LLMUsageLog.total_tokens).label("tokens"),
                 func.count(LLMUsageLog.id).label("calls"),
             )
+            .where(LLMUsageLog.tenant_id == tenant_id, live)
+            .group_by(LLMUsageLog.provider, LLMUsageLog.model)
+        )
+        live_rows = (await db.execute(live_query)).tuples().all()
+
+        rollup_rows: Tuple[Tuple, ...] = ()
+        if rollup_days is not None:
+            rollup_rows = await MetricsService._rollup_breakdown(
+                db, tenant_id, rollup_days, now
+            )
+
+        breakdown: Dict[Tuple[str, str], Dict] = {}
+        for rows in (live_rows, rollup_rows):
+            for provider, model, cost, tokens, calls in rows:
+                entry = breakdown.get((provider, model))
+                if entry is None:
+                    entry = breakdown[(provider, model)] = {
+                        "provider": provider,
+                        "model": model,
+                        "cost_usd": 0.0,
+                        "tokens": 0,
+                        "calls": 0,
+                    }
+                entry["cost_usd"] += float(cost)
+                entry["tokens"] += int(tokens)
+                entry["calls"] += int(calls)
+
+        return sorted(breakdown.values(), key=lambda e: e["cost_usd"], reverse=True)
+
+    @staticmethod
+    async def _rollup_breakdown(
+        db: AsyncSession,
+        tenant_id: str,
+        days: Tuple[date, date],
+        now: datetime,
+    ) -> Tuple[Tuple, ...]:
+        """Per-model rollup totals for the whole days in [days[0], days[1]).
+
+        Once the range has settled, the rows are cached under the day range
+        alone, so every window covering the same days shares one entry. A
+        flush still in flight at the settle point or a later backfill can make
+        an entry stale; the TTL bounds how long that lasts.
+        """
+        cache_key = (tenant_id, days[0], days[1])
+        settled = now >= datetime.combine(days[1], datetime.min.time()) + timedelta(
+            seconds=BREAKDOWN_CACHE_SETTLE_SECONDS
+        )
+        if settled:
+            cached = _breakdown_cache.get(cache_key)
+            if cached is not None and time.monotonic() - cached[0] < (
+                BREAKDOWN_CACHE_TTL_SECONDS
+            ):
+                return cached[1]
+
+        query = (
+            select(
+                LLMUsageDailyRollup.provider,
+                LLMUsageDailyRollup.model,
+                func.sum(LLMUsageDailyRollup.cost_usd).label("cost"),
+                func.sum(LLMUsageDailyRollup.total_tokens).label("tokens"),
+                func.sum(LLMUsageDailyRollup.total_calls).label("calls"),
+            )
             .where(
-                LLMUsageLog.tenant_id == tenant_id, LLMUsageLog.timestamp >= start_date
+                LLMUsageDailyRollup.tenant_id == tenant_id,
+                LLMUsageDailyRollup.day >= days[0],
+                LLMUsageDailyRollup.day < days[1],
             )
-            .group_by(LLMUsageLog.provider, LLMUsageLog.model)
-            .order_by(func.sum(LLMUsageLog.cost_usd).desc())
+            .group_by(LLMUsageDailyRollup.provider, LLMUsageDailyRollup.model)
         )
+        rows = tuple((await db.execute(query)).tuples().all())
 
-        return [
-            {
-                "provider": row.provider,
-                "model": row.model,
-                "cost_usd": float(row.cost),
-                "tokens": int(row.tokens),
-                "calls": int(row.calls),
-            }
-            for row in result
-        ]
+        if settled:
+            _breakdown_cache.pop(cache_key, None)
+            if len(_breakdown_cache) >= BREAKDOWN_CACHE_MAXSIZE:
+                _breakdown_cache.pop(next(iter(_breakdown_cache)))
+            _breakdown_cache[cache_key] = (time.monotonic(), rows)
+
+        return rows
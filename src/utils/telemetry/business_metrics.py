@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Any, Dict, Optional, Tuple
 
 import structlog
 from opentelemetry import metrics
@@ -6,6 +6,10 @@ from prometheus_client import Counter, Gauge, Histogram
 
 logger = structlog.get_logger()
 
+# Per-class LLM cost is recorded in the DB (llm_usage_logs and its daily rollup,
+# via MetricsService.log_llm_usage), not as a Prometheus label.
+MAX_METRIC_LABELS = 5
+
 
 class BusinessMetrics:
     def __init__(self):
@@ -14,19 +18,19 @@ class BusinessMetrics:
         self.lesson_requests = Counter(
             "lesson_generation_requests_total",
             "Total lesson generation requests",
-            ["class_id", "subject", "grade", "status"],
+            ["subject", "grade", "status"],
         )
 
         self.quiz_requests = Counter(
             "quiz_generation_requests_total",
             "Total quiz generation requests",
-            ["class_id§", "subject", "grade", "status"],
+            ["class_id", "subject", "grade", "status"],
         )
 
         self.lesson_generation_duration = Histogram(
             "lesson_generation_duration_seconds",
             "Lesson generation duration",
-            ["class_id", "subject"],
+            ["subject"],
             buckets=[1, 2, 5, 10, 20, 30, 60],
         )
 
@@ -57,7 +61,7 @@ class BusinessMetrics:
         self.llm_cost = Counter(
             "llm_cost_usd_total",
             "Total LLM cost in USD",
-            ["class_id", "provider", "model"],
+            ["provider", "model"],
         )
 
         self.solver_attempts = Counter(
@@ -85,11 +89,20 @@ class BusinessMetrics:
             buckets=[0, 0.2, 0.4, 0.6, 0.7, 0.8, 0.9, 1.0],
         )
 
+        # multiprocess_mode only matters when PROMETHEUS_MULTIPROC_DIR is set.
         self.active_users = Gauge(
-            "active_users_current", "Current active users", ["class_id"]
+            "active_users_current",
+            "Current active users",
+            ["class_id"],
+            multiprocess_mode="livesum",
         )
 
-        self.cache_hit_rate = Gauge("cache_hit_rate", "Cache hit rate", ["cache_type"])
+        self.cache_hit_rate = Gauge(
+            "cache_hit_rate",
+            "Cache hit rate",
+            ["cache_type"],
+            multiprocess_mode="mostrecent",
+        )
 
         self.revenue_tracking = Counter(
             "revenue_usd_total", "Total revenue", ["class_id", "tier"]
@@ -99,26 +112,52 @@ class BusinessMetrics:
             "feature_usage_total", "Feature usage count", ["class_id", "feature_name"]
         )
 
+        for metric in vars(self).values():
+            labelnames = getattr(metric, "_labelnames", ())
+            assert len(labelnames) <= MAX_METRIC_LABELS, metric
+
+        # Label-bound children, keyed by label values in declaration order.
+        self._lesson_requests_cache: Dict[Tuple, Any] = {}
+        self._lesson_duration_cache: Dict[Tuple, Any] = {}
+        self._llm_calls_cache: Dict[Tuple, Any] = {}
+        self._llm_tokens_cache: Dict[Tuple, Any] = {}
+        self._llm_cost_cache: Dict[Tuple, Any] = {}
+        self._solver_attempts_cache: Dict[Tuple, Any] = {}
+        self._validation_failures_cache: Dict[Tuple, Any] = {}
+        self._quiz_completions_cache: Dict[Tuple, Any] = {}
+        self._quiz_scores_cache: Dict[Tuple, Any] = {}
+        self._active_users_cache: Dict[Tuple, Any] = {}
+        self._revenue_cache: Dict[Tuple, Any] = {}
+
+    @staticmethod
+    def _get(metric, cache: Dict[Tuple, Any], key: Tuple):
+        child = cache.get(key)
+        if child is None:
+            child = cache[key] = metric.labels(*key)
+        return child
+
     def track_lesson_request(
         self,
-        class_id: str,
         subject: str,
         grade: int,
         status: str,
         duration: Optional[float] = None,
     ):
-        self.lesson_requests.labels(
-            class_id=class_id, subject=subject, grade=str(grade), status=status
+        self._get(
+            self.lesson_requests,
+            self._lesson_requests_cache,
+            (subject, str(grade), status),
         ).inc()
 
         if duration:
-            self.lesson_generation_duration.labels(
-                class_id=class_id, subject=subject
+            self._get(
+                self.lesson_generation_duration,
+                self._lesson_duration_cache,
+                (subject,),
             ).observe(duration)
 
     def track_llm_call(
         self,
-        class_id: str,
         provider: str,
         model: str,
         purpose: str,
@@ -127,48 +166,48 @@ class BusinessMetrics:
         status: str,
         cost_usd: float,
     ):
-        self.llm_calls.labels(
-            provider=provider, model=model, purpose=purpose, status=status
+        self._get(
+            self.llm_calls, self._llm_calls_cache, (provider, model, purpose, status)
         ).inc()
 
-        self.llm_tokens.labels(provider=provider, model=model, token_type="input").inc(
-            input_tokens
-        )
+        self._get(
+            self.llm_tokens, self._llm_tokens_cache, (provider, model, "input")
+        ).inc(input_tokens)
 
-        self.llm_tokens.labels(provider=provider, model=model, token_type="output").inc(
-            output_tokens
-        )
+        self._get(
+            self.llm_tokens, self._llm_tokens_cache, (provider, model, "output")
+        ).inc(output_tokens)
 
-        self.llm_cost.labels(class_id=class_id, provider=provider, model=model).inc(
-            cost_usd
-        )
+        self._get(self.llm_cost, self._llm_cost_cache, (provider, model)).inc(cost_usd)
 
     def track_solver_attempt(self, subject: str, question_type: str, success: bool):
-        self.solver_attempts.labels(
-            subject=subject, question_type=question_type, success=str(success)
+        self._get(
+            self.solver_attempts,
+            self._solver_attempts_cache,
+            (subject, question_type, str(success)),
         ).inc()
 
     def track_quiz_completion(
-        self, tenant_id: str, subject: str, grade: int, score: float
+        self, class_id: str, subject: str, grade: int, score: float
     ):
-        self.quiz_completions.labels(
-            tenant_id=tenant_id, subject=subject, grade=str(grade)
-        ).inc()
-
-        self.quiz_scores.labels(
-            tenant_id=tenant_id, subject=subject, grade=str(grade)
-        ).observe(score)
+        key = (class_id, subject, str(grade))
+        self._get(self.quiz_completions, self._quiz_completions_cache, key).inc()
+        self._get(self.quiz_scores, self._quiz_scores_cache, key).observe(score)
 
     def track_validation_failure(self, subject: str, reason: str):
-        self.quiz_validation_failures.labels(
-            subject=subject, failure_reason=reason
+        self._get(
+            self.quiz_validation_failures,
+            self._validation_failures_cache,
+            (subject, reason),
         ).inc()
 
-    def update_active_users(self, tenant_id: str, count: int):
-        self.active_users.labels(tenant_id=tenant_id).set(count)
+    def update_active_users(self, class_id: str, count: int):
+        self._get(self.active_users, self._active_users_cache, (class_id,)).set(count)
 
-    def track_revenue(self, tenant_id: str, tier: str, amount_usd: float):
-        self.revenue_tracking.labels(tenant_id=tenant_id, tier=tier).inc(amount_usd)
+    def track_revenue(self, class_id: str, tier: str, amount_usd: float):
+        self._get(self.revenue_tracking, self._revenue_cache, (class_id, tier)).inc(
+            amount_usd
+        )
 
 
 business_metrics = BusinessMetrics()
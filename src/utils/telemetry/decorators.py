@@ -1,103 +1,165 @@
+import inspect
 import time
 from functools import wraps
+from types import MappingProxyType
 from typing import Any, Callable, Dict, Optional
 
 import structlog
-from app import settings
 from opentelemetry import trace
 from opentelemetry.trace import Status, StatusCode
 
+from src.services.metrics_service import MetricsService
 from src.utils.telemetry.business_metrics import business_metrics
 
 logger = structlog.get_logger()
 tracer = trace.get_tracer(__name__)
 
+STATE_ATTRIBUTES = ("class_id", "subject", "trace_id")
 
-def traceable(name: Optional[str] = None, metadata: Optional[Dict[str, Any]] = None):
-    def decorator(func: Callable) -> Callable:
-        @wraps(func)
-        async def async_wrapper(*args, **kwargs):
-            span_name = name or func.__name__
+# USD per input/output token (list price per 1k tokens, pre-divided by 1000).
+LLM_PRICING = MappingProxyType(
+    {
+        ("openai", "gpt-4"): (0.03 / 1000, 0.06 / 1000),
+        ("openai", "gpt-4o"): (0.0025 / 1000, 0.01 / 1000),
+        ("openai", "gpt-4o-mini"): (0.00015 / 1000, 0.0006 / 1000),
+        ("openai", "gpt-3.5-turbo"): (0.0005 / 1000, 0.0015 / 1000),
+        ("google", "gemini-1.5-flash"): (0.000075 / 1000, 0.0003 / 1000),
+    }
+)
 
-            with tracer.start_as_current_span(span_name) as span:
-                if metadata:
-                    for key, value in metadata.items():
-                        span.set_attribute(key, str(value))
+ERROR_LOG_RATE_PER_SECOND = 1.0
+ERROR_LOG_BURST = 10
 
-                if args and hasattr(args[0], "__getitem__"):
-                    state = args[0]
-                    if isinstance(state, dict):
-                        span.set_attribute("class_id", state.get("class_id", "unknown"))
-                        span.set_attribute("subject", state.get("subject", "unknown"))
-                        span.set_attribute("trace_id", state.get("trace_id", "unknown"))
 
-                start_time = time.time()
+class _TokenBucket:
+    """Rate limiter for error logs; the span still records every exception."""
 
-                try:
-                    result = await func(*args, **kwargs)
+    __slots__ = ("tokens", "updated_at")
 
-                    duration = time.time() - start_time
-                    span.set_attribute("duration_seconds", duration)
-                    span.set_status(Status(StatusCode.OK))
+    def __init__(self):
+        self.tokens = float(ERROR_LOG_BURST)
+        self.updated_at = time.monotonic()
 
-                    return result
+    def allow(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(
+            ERROR_LOG_BURST,
+            self.tokens + (now - self.updated_at) * ERROR_LOG_RATE_PER_SECOND,
+        )
+        self.updated_at = now
 
-                except Exception as e:
-                    duration = time.time() - start_time
-                    span.set_attribute("duration_seconds", duration)
-                    span.set_status(Status(StatusCode.ERROR, str(e)))
-                    span.record_exception(e)
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
 
-                    logger.error(
-                        "trace_error",
-                        span_name=span_name,
-                        error=str(e),
-                        duration=duration,
-                    )
-                    raise
+
+def traceable(
+    name: Optional[str] = None,
+    metadata: Optional[Dict[str, Any]] = None,
+    extract_state: bool = False,
+):
+    metadata_attributes = {key: str(value) for key, value in (metadata or {}).items()}
+
+    def decorator(func: Callable) -> Callable:
+        span_name = name or func.__name__
+
+        if inspect.iscoroutinefunction(func):
+            span_logger = logger.bind(span_name=span_name)
+            error_log_bucket = _TokenBucket()
+
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with tracer.start_as_current_span(span_name) as span:
+                    # Unsampled spans drop every attribute, so skip the span
+                    # bookkeeping but keep the error log.
+                    if not span.is_recording():
+                        try:
+                            return await func(*args, **kwargs)
+                        except Exception as e:
+                            if error_log_bucket.allow():
+                                span_logger.error("trace_error", error=str(e))
+                            raise
+
+                    if extract_state and args and isinstance(args[0], dict):
+                        state = args[0]
+                        attributes = dict(metadata_attributes)
+                        for key in STATE_ATTRIBUTES:
+                            attributes[key] = state.get(key, "unknown")
+                        span.set_attributes(attributes)
+                    elif metadata_attributes:
+                        span.set_attributes(metadata_attributes)
+
+                    start_ns = time.perf_counter_ns()
+
+                    try:
+                        result = await func(*args, **kwargs)
+
+                        duration = (time.perf_counter_ns() - start_ns) / 1e9
+                        span.set_attribute("duration_seconds", duration)
+                        span.set_status(Status(StatusCode.OK))
+
+                        return result
+
+                    except Exception as e:
+                        duration = (time.perf_counter_ns() - start_ns) / 1e9
+                        error = str(e)
+                        span.set_attribute("duration_seconds", duration)
+                        span.set_status(Status(StatusCode.ERROR, error))
+                        span.record_exception(e)
+
+                        if error_log_bucket.allow():
+                            span_logger.error("trace_error", error=error)
+                        raise
+
+            return async_wrapper
 
         @wraps(func)
         def sync_wrapper(*args, **kwargs):
-            span_name = name or func.__name__
-
             with tracer.start_as_current_span(span_name) as span:
-                if metadata:
-                    for key, value in metadata.items():
-                        span.set_attribute(key, str(value))
+                if not span.is_recording():
+                    return func(*args, **kwargs)
+
+                if extract_state and args and isinstance(args[0], dict):
+                    state = args[0]
+                    attributes = dict(metadata_attributes)
+                    for key in STATE_ATTRIBUTES:
+                        attributes[key] = state.get(key, "unknown")
+                    span.set_attributes(attributes)
+                elif metadata_attributes:
+                    span.set_attributes(metadata_attributes)
 
-                start_time = time.time()
+                start_ns = time.perf_counter_ns()
 
                 try:
                     result = func(*args, **kwargs)
 
-                    duration = time.time() - start_time
+                    duration = (time.perf_counter_ns() - start_ns) / 1e9
                     span.set_attribute("duration_seconds", duration)
                     span.set_status(Status(StatusCode.OK))
 
                     return result
 
                 except Exception as e:
-                    duration = time.time() - start_time
+                    duration = (time.perf_counter_ns() - start_ns) / 1e9
                     span.set_attribute("duration_seconds", duration)
                     span.set_status(Status(StatusCode.ERROR, str(e)))
                     span.record_exception(e)
                     raise
 
-        import inspect
-
-        if inspect.iscoroutinefunction(func):
-            return async_wrapper
-        else:
-            return sync_wrapper
+        return sync_wrapper
 
     return decorator
 
 
 def track_llm_call(provider: str, model: str, purpose: str):
+    # Provider and model are fixed per decorated function, so price them once.
+    input_rate, output_rate = LLM_PRICING.get((provider, model), (0.0, 0.0))
+
     def decorator(func: Callable) -> Callable:
         @wraps(func)
         async def wrapper(*args, **kwargs):
-            start_time = time.time()
+            start_ns = time.perf_counter_ns()
 
             try:
                 result = await func(*args, **kwargs)
@@ -105,17 +167,9 @@ def track_llm_call(provider: str, model: str, purpose: str):
                 input_tokens = result.get("usage", {}).get("prompt_tokens", 0)
                 output_tokens = result.get("usage", {}).get("completion_tokens", 0)
 
-                total_tokens = input_tokens + output_tokens
-                cost_per_1k = (
-                    settings.telemetry.openai_cost_per_1k_tokens
-                    if provider == "openai"
-                    else 0
-                )
-                cost_usd = (total_tokens / 1000) * cost_per_1k
+                cost_usd = input_tokens * input_rate + output_tokens * output_rate
 
-                class_id = kwargs.get("class_id", "unknown")
                 business_metrics.track_llm_call(
-                    class_id=class_id,
                     provider=provider,
                     model=model,
                     purpose=purpose,
@@ -125,6 +179,28 @@ def track_llm_call(provider: str, model: str, purpose: str):
                     cost_usd=cost_usd,
                 )
 
+                # Per-tenant and per-class cost goes to the usage log, which
+                # needs the tenant; callers without one only get the counters.
+                if "tenant_id" in kwargs:
+                    span_context = trace.get_current_span().get_span_context()
+                    await MetricsService.log_llm_usage(
+                        tenant_id=kwargs["tenant_id"],
+                        user_id=kwargs.get("user_id"),
+                        provider=provider,
+                        model=model,
+                        purpose=purpose,
+                        input_tokens=input_tokens,
+                        output_tokens=output_tokens,
+                        cost_usd=cost_usd,
+                        request_id=kwargs.get("request_id"),
+                        trace_id=(
+                            format(span_context.trace_id, "032x")
+                            if span_context.is_valid
+                            else None
+                        ),
+                        class_id=kwargs.get("class_id"),
+                    )
+
                 logger.info(
                     "llm_call_completed",
                     provider=provider,
@@ -132,14 +208,13 @@ def track_llm_call(provider: str, model: str, purpose: str):
                     input_tokens=input_tokens,
                     output_tokens=output_tokens,
                     cost_usd=round(cost_usd, 4),
-                    duration=time.time() - start_time,
+                    duration=(time.perf_counter_ns() - start_ns) / 1e9,
                 )
 
                 return result
 
             except Exception:
                 business_metrics.track_llm_call(
-                    tenant_id=kwargs.get("tenant_id", "unknown"),
                     provider=provider,
                     model=model,
                     purpose=purpose,
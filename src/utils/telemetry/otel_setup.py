@@ -1,5 +1,8 @@
+import os
+
 import structlog
 from core.config import settings
+from grpc import Compression
 from opentelemetry import metrics, trace
 from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
 from opentelemetry.exporter.prometheus import PrometheusMetricReader
@@ -9,6 +12,7 @@ from opentelemetry.sdk.metrics import MeterProvider
 from opentelemetry.sdk.resources import SERVICE_NAME, SERVICE_VERSION, Resource
 from opentelemetry.sdk.trace import TracerProvider
 from opentelemetry.sdk.trace.export import BatchSpanProcessor
+from prometheus_client import REGISTRY, CollectorRegistry, multiprocess
 
 logger = structlog.get_logger()
 
@@ -17,6 +21,7 @@ class OpenTelemetrySetup:
     def __init__(self):
         self.tracer_provider = None
         self.meter_provider = None
+        self.prometheus_reader = None
 
     def setup(self):
         if not settings.TELEMETRY.otel_enabled:
@@ -35,25 +40,54 @@ class OpenTelemetrySetup:
 
         if settings.TELEMETRY.otel_endpoint:
             otlp_exporter = OTLPSpanExporter(
-                endpoint=settings.TELEMETRY.otel_endpoint, insecure=True
+                endpoint=settings.TELEMETRY.otel_endpoint,
+                insecure=True,
+                compression=(
+                    Compression.Gzip
+                    if settings.TELEMETRY.otel_gzip_compression
+                    else Compression.NoCompression
+                ),
+            )
+            self.tracer_provider.add_span_processor(
+                BatchSpanProcessor(
+                    otlp_exporter,
+                    max_queue_size=settings.TELEMETRY.otel_max_queue_size,
+                    max_export_batch_size=settings.TELEMETRY.otel_max_export_batch_size,
+                    schedule_delay_millis=settings.TELEMETRY.otel_schedule_delay_millis,
+                )
             )
-            self.tracer_provider.add_span_processor(BatchSpanProcessor(otlp_exporter))
 
         trace.set_tracer_provider(self.tracer_provider)
 
-        prometheus_reader = PrometheusMetricReader()
+        self.prometheus_reader = PrometheusMetricReader()
         self.meter_provider = MeterProvider(
-            resource=resource, metric_readers=[prometheus_reader]
+            resource=resource, metric_readers=[self.prometheus_reader]
         )
         metrics.set_meter_provider(self.meter_provider)
 
         logger.info("otel_configured")
 
+    def metrics_registry(self):
+        # With PROMETHEUS_MULTIPROC_DIR set, each worker writes its own mmap files
+        # and the scrape aggregates them, so /metrics needs a fresh registry.
+        if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+            return REGISTRY
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        # The OTel reader registers itself on the default REGISTRY only; its
+        # metrics are per worker, as the reader keeps them in memory.
+        if self.prometheus_reader is not None:
+            registry.register(self.prometheus_reader._collector)
+        return registry
+
     def instrument_app(self, app):
         FastAPIInstrumentor.instrument_app(app)
         logger.info("fastapi_instrumented")
 
     def instrument_db(self, engine):
+        # The engine caches prepared statements per connection (see db.session);
+        # pgbouncer in front of it must run in session, not transaction, mode.
         SQLAlchemyInstrumentor().instrument(engine=engine.sync_engine)
         logger.info("sqlalchemy_instrumented")
 
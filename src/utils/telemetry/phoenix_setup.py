@@ -1,14 +1,14 @@
-import phoenix as px
+import os
+
 import structlog
 from core.config import settings
-from openinference.instrumentation.langchain import LangChainInstrumentor
 
 logger = structlog.get_logger()
 
 
 class PhoenixTelemetry:
     def __init__(self):
-        self.session = None
+        self.tracer_provider = None
         self.instrumentors = []
 
     def setup(self):
@@ -16,21 +16,33 @@ class PhoenixTelemetry:
             logger.info("phoenix_disabled")
             return
 
+        # Phoenix runs as its own service; only the exporter lives in-process.
+        collector_url = os.getenv(
+            "PHOENIX_COLLECTOR_ENDPOINT", settings.TELEMETRY.phoenix_url
+        )
+
         try:
-            self.session = px.launch_app(
-                host="0.0.0.0",
-                port=6006,
-                project_name=settings.telemetry.phoenix_project_name,
+            # Imported here so processes with Phoenix disabled never load the
+            # exporter stack or patch LangChain.
+            from openinference.instrumentation.langchain import LangChainInstrumentor
+            from phoenix.otel import register
+
+            self.tracer_provider = register(
+                project_name=settings.TELEMETRY.phoenix_project_name,
+                endpoint=f"{collector_url}/v1/traces",
+                set_global_tracer_provider=False,
+                batch=True,
+                verbose=False,
             )
 
             langchain_instrumentor = LangChainInstrumentor()
-            langchain_instrumentor.instrument()
+            langchain_instrumentor.instrument(tracer_provider=self.tracer_provider)
             self.instrumentors.append(langchain_instrumentor)
 
             logger.info(
-                "phoenix_started",
-                url="http://localhost:6006",
-                project=settings.telemetry.phoenix_project_name,
+                "phoenix_connected",
+                url=collector_url,
+                project=settings.TELEMETRY.phoenix_project_name,
             )
 
         except Exception as e:
@@ -40,8 +52,8 @@ class PhoenixTelemetry:
         for instrumentor in self.instrumentors:
             instrumentor.uninstrument()
 
-        if self.session:
-            px.close_app()
+        if self.tracer_provider:
+            self.tracer_provider.shutdown()
 
         logger.info("phoenix_shutdown")
 
@@ -0,0 +1,185 @@
+import asyncio
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+
+from services import metrics_service
+from services.metrics_service import MetricsService
+
+
+def _usage(n, class_id=None):
+    return dict(
+        tenant_id="tenant",
+        user_id="user",
+        class_id=class_id,
+        provider="openai",
+        model="gpt-4",
+        purpose="lesson",
+        input_tokens=n,
+        output_tokens=1,
+        cost_usd=0.01,
+        request_id=f"req-{n}",
+        trace_id="trace",
+    )
+
+
+@pytest.fixture
+def written(monkeypatch):
+    batches = []
+
+    async def fake_write(batch):
+        await asyncio.sleep(0)
+        batches.append(list(batch))
+
+    monkeypatch.setattr(MetricsService, "_write_llm_usage", staticmethod(fake_write))
+    monkeypatch.setattr(MetricsService, "_llm_usage_queue", None)
+    monkeypatch.setattr(MetricsService, "_flusher_task", None)
+    return batches
+
+
+class TestSplitWindow:
+    def test_same_day_window_is_live_only(self):
+        days, _ = MetricsService._split_window(
+            datetime(2024, 3, 5, 9), datetime(2024, 3, 5, 17)
+        )
+        assert days is None
+
+    def test_partial_edges_are_excluded_from_rollup(self):
+        days, _ = MetricsService._split_window(
+            datetime(2024, 3, 1, 12), datetime(2024, 3, 5, 8)
+        )
+        assert days == (date(2024, 3, 2), date(2024, 3, 5))
+
+    def test_midnight_start_is_a_whole_day(self):
+        days, _ = MetricsService._split_window(
+            datetime(2024, 3, 1), datetime(2024, 3, 4, 0, 30)
+        )
+        assert days == (date(2024, 3, 1), date(2024, 3, 4))
+
+
+class TestLLMUsageFlusher:
+    @pytest.mark.asyncio
+    async def test_rows_are_batched(self, written, monkeypatch):
+        monkeypatch.setattr(metrics_service, "LLM_USAGE_BATCH_SIZE", 3)
+
+        for n in range(7):
+            await MetricsService.log_llm_usage(**_usage(n))
+        await MetricsService.stop()
+
+        assert [len(batch) for batch in written] == [3, 3, 1]
+        assert [row["input_tokens"] for batch in written for row in batch] == list(
+            range(7)
+        )
+
+    @pytest.mark.asyncio
+    async def test_stop_drains_queue_exactly_once(self, written):
+        for n in range(5):
+            await MetricsService.log_llm_usage(**_usage(n, class_id="class-a"))
+        await MetricsService.stop()
+
+        rows = [row for batch in written for row in batch]
+        assert [row["request_id"] for row in rows] == [f"req-{n}" for n in range(5)]
+        assert all(row["class_id"] == "class-a" for row in rows)
+        assert MetricsService._flusher_task is None
+
+    @pytest.mark.asyncio
+    async def test_stop_waits_for_write_in_progress(self, monkeypatch):
+        started = asyncio.Event()
+        finished = []
+
+        async def slow_write(batch):
+            started.set()
+            await asyncio.sleep(0.05)
+            finished.append(len(batch))
+
+        monkeypatch.setattr(
+            MetricsService, "_write_llm_usage", staticmethod(slow_write)
+        )
+        monkeypatch.setattr(MetricsService, "_llm_usage_queue", None)
+        monkeypatch.setattr(MetricsService, "_flusher_task", None)
+        monkeypatch.setattr(metrics_service, "LLM_USAGE_FLUSH_INTERVAL_SECONDS", 0)
+
+        await MetricsService.log_llm_usage(**_usage(0))
+        await started.wait()
+        await MetricsService.stop()
+
+        assert finished == [1]
+
+
+class _FakeResult:
+    def __init__(self, rows):
+        self._rows = rows
+
+    def tuples(self):
+        return self
+
+    def all(self):
+        return self._rows
+
+
+class _FakeDB:
+    def __init__(self, rows):
+        self.rows = rows
+        self.calls = 0
+
+    async def execute(self, query):
+        self.calls += 1
+        return _FakeResult(self.rows)
+
+
+class TestCostBreakdownCache:
+    @pytest.fixture(autouse=True)
+    def empty_cache(self, monkeypatch):
+        monkeypatch.setattr(metrics_service, "_breakdown_cache", {})
+
+    @pytest.mark.asyncio
+    async def test_settled_rollup_is_served_from_cache(self):
+        db = _FakeDB([("openai", "gpt-4", 1.5, 100, 2)])
+        start = datetime(2024, 3, 1, 12)
+        end = datetime(2024, 3, 5, 8)
+
+        first = await MetricsService.get_cost_breakdown_by_model(db, "t", start, end)
+        assert db.calls == 2
+        first[0]["cost_usd"] = 0
+
+        second = await MetricsService.get_cost_breakdown_by_model(db, "t", start, end)
+        assert db.calls == 3  # only the live edges are queried again
+        assert second == [
+            {
+                "provider": "openai",
+                "model": "gpt-4",
+                "cost_usd": 3.0,
+                "tokens": 200,
+                "calls": 4,
+            }
+        ]
+
+    @pytest.mark.asyncio
+    async def test_windows_over_the_same_days_share_an_entry(self):
+        db = _FakeDB([("openai", "gpt-4", 1.5, 100, 2)])
+
+        await MetricsService.get_cost_breakdown_by_model(
+            db, "t", datetime(2024, 3, 1, 12), datetime(2024, 3, 5, 8)
+        )
+        # 11:00+01:00 is 10:00 UTC on the same day, so the rollup days match.
+        await MetricsService.get_cost_breakdown_by_model(
+            db,
+            "t",
+            datetime(2024, 3, 1, 11, tzinfo=timezone(timedelta(hours=1))),
+            datetime(2024, 3, 5, 23),
+        )
+
+        assert db.calls == 3
+
+    @pytest.mark.asyncio
+    async def test_unsettled_rollup_is_not_cached(self, monkeypatch):
+        db = _FakeDB([("openai", "gpt-4", 1.5, 100, 2)])
+        monkeypatch.setattr(
+            metrics_service, "_utcnow", lambda: datetime(2024, 3, 5, 0, 0, 30)
+        )
+        start = datetime(2024, 3, 1, 12)
+
+        await MetricsService.get_cost_breakdown_by_model(db, "t", start)
+        await MetricsService.get_cost_breakdown_by_model(db, "t", start)
+
+        assert db.calls == 4